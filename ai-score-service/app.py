@@ -1,22 +1,82 @@
+import os
+
+# Scoring a single row (or a small batch) gains nothing from an OpenMP thread team; parallelism comes
+# from the model thread pool instead. Must be set before LightGBM is loaded.
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+import asyncio
+import ctypes
+import hashlib
+import heapq
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import joblib
-import pandas as pd
-from typing import Dict, Any
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
+from typing import Annotated, Dict, Any, List, NamedTuple, Sequence, Set
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
+import msgspec
 import numpy as np # Needed for array handling from predict_proba
+from inference_worker import ShmInferenceClient
+
+try:
+    # Optional: compiles the tree ensemble to native code for fast single-row inference
+    import lleaves
+    from llvmlite import binding as llvm
+except ImportError:
+    lleaves = None
+    llvm = None
+
+try:
+    # Optional (RAPIDS, needs a CUDA GPU): GPU-resident tree inference for large batches
+    import cupy
+    from cuml import ForestInference
+except ImportError:
+    cupy = None
+    ForestInference = None
 
 # --- Configuration ---
 # Set the number of top features you want to return
 TOP_N_FEATURES = 5 
 
+MODEL_PATH = "models/lgb_model.pkl"
+# Plain-text Booster dump consumed by lleaves, and the template for its compiled kernel's cache file.
+# lleaves reuses an existing cache file without checking it, so the name carries a hash of everything the
+# kernel depends on (see _compiled_model_cache)
+BOOSTER_TXT_PATH = "models/lgb.txt"
+COMPILED_MODEL_CACHE = "models/lgb_{key}.so"
+# Optional AOT-compiled C predictor, built offline from the Booster dump with Timber:
+#   timber compile models/lgb.txt --format lightgbm --out models/libfraud.so
+NATIVE_MODEL_LIB = "models/libfraud.so"
+
+# Micro-batching: requests arriving within the wait window are scored in a single model call
+BATCH_MAX_SIZE = 64
+BATCH_MAX_WAIT_MS = 2
+# Smaller batches stay on the CPU predictors: below this size the host/device transfer outweighs the GPU win.
+# A batch is sent as soon as a pool thread is free, so only full batches reach the GPU, and batches only
+# fill up once requests queue behind busy pool threads: the GPU serves the service under sustained load.
+GPU_MIN_BATCH = BATCH_MAX_SIZE
+
+# Model inference runs off the event loop; the native predictors release the GIL, so batches use all cores.
+# This pool is the service's only source of parallelism: it runs as a single uvicorn worker (see the
+# Dockerfile), since more workers would each bring a pool this size and split requests across batchers.
+MODEL_POOL_WORKERS = os.cpu_count() or 1
+
+# Opt-in (SHM_INFERENCE=1): score batches in a separate inference process fed through shared memory,
+# with one ring slot per in-flight batch, instead of on the in-process thread pool
+SHM_INFERENCE = os.environ.get("SHM_INFERENCE") == "1"
+
 # --- Model Loading ---
 try:
     # Load the pre-trained model
-    model = joblib.load("models/lgb_model.pkl")
+    model = joblib.load(MODEL_PATH)
     print("Model loaded successfully.")
     # Check if the model has the predict_proba method, which is necessary for probability output
     if not hasattr(model, 'predict_proba'):
         raise AttributeError("Loaded model does not have a 'predict_proba' method. Is it a classifier?")
+    # Pin every predict_proba call to one thread; the sklearn wrapper forwards n_jobs as num_threads.
+    # (Booster.reset_parameter is not an option: it crashes on a Booster restored without training data.)
+    model.set_params(n_jobs=1)
 except FileNotFoundError:
     print("ERROR: Model file 'models/lgb_model.pkl' not found.")
     model = None
@@ -27,6 +87,264 @@ except Exception as e:
     print(f"ERROR during model loading: {e}")
     model = None
 
+# Fixed column order the model was trained with; requests are laid out in this order.
+FEATURE_NAMES = model.booster_.feature_name() if model is not None else []
+
+# --- Native Model Library (Timber) ---
+native_lib = None
+
+
+def _predict_native(batch: np.ndarray) -> np.ndarray:
+    """Scores a C-contiguous float32 batch one row at a time with the native library's predict()."""
+    out = np.empty(batch.shape[0], dtype=np.float32)
+    row_bytes = batch.strides[0]
+    base = batch.ctypes.data
+    out_base = out.ctypes.data
+    float_p = ctypes.POINTER(ctypes.c_float)
+    for i in range(batch.shape[0]):
+        native_lib.predict(
+            ctypes.cast(base + i * row_bytes, float_p),
+            batch.shape[1],
+            ctypes.cast(out_base + i * out.itemsize, float_p)
+        )
+    return out
+
+
+if model is not None and os.path.exists(NATIVE_MODEL_LIB):
+    try:
+        native_lib = ctypes.CDLL(os.path.abspath(NATIVE_MODEL_LIB))
+        native_lib.predict.argtypes = [ctypes.POINTER(ctypes.c_float), ctypes.c_int, ctypes.POINTER(ctypes.c_float)]
+        native_lib.predict.restype = None
+        # Refuse a library that was built from a different model or returns raw scores
+        probe = np.zeros((1, len(FEATURE_NAMES)), dtype=np.float32)
+        expected = model.predict_proba(probe, validate_features=False)[0, 1]
+        if not np.isclose(_predict_native(probe)[0], expected, atol=1e-5):
+            raise ValueError("native predictions do not match the LightGBM model")
+        print("Native model library loaded.")
+    except Exception as e:
+        print(f"WARNING: Native model library unusable, falling back: {e}")
+        native_lib = None
+
+def _dump_booster() -> str:
+    """
+    Writes the Booster's text dump to BOOSTER_TXT_PATH and returns it. Every worker (and the shared-memory
+    inference process) writes it at import, so it goes to a private file that is renamed into place.
+    """
+    booster_txt = model.booster_.model_to_string()
+    staging = f"{BOOSTER_TXT_PATH}.{os.getpid()}.tmp"
+    with open(staging, "w") as f:
+        f.write(booster_txt)
+    os.replace(staging, BOOSTER_TXT_PATH)
+    return booster_txt
+
+# --- Native Model Compilation (lleaves) ---
+def _compiled_model_cache(booster_txt: str, use_fp64: bool) -> str:
+    """
+    Cache path for the lleaves kernel of this exact model text and precision, built for the host CPU,
+    so a retrained model or a kernel compiled on another machine is never picked up.
+    """
+    key = hashlib.sha256()
+    for part in (booster_txt, "fp64" if use_fp64 else "fp32", llvm.get_host_cpu_name(), llvm.get_host_cpu_features().flatten()):
+        key.update(part.encode())
+        key.update(b"\0")
+    return COMPILED_MODEL_CACHE.format(key=key.hexdigest()[:16])
+
+
+# Only needed when the native library isn't deployed
+llvm_model = None
+if model is not None and native_lib is None and lleaves is not None:
+    try:
+        booster_txt = _dump_booster()
+        llvm_model = lleaves.Model(model_file=BOOSTER_TXT_PATH)
+        # fp64 kernel: the split thresholds are doubles, and a float32 kernel rounds them, sending rows that sit
+        # on a threshold down the other branch. lleaves widens the float32 batches to float64 on the way in.
+        compiled_cache = _compiled_model_cache(booster_txt, use_fp64=True)
+        if os.path.exists(compiled_cache):
+            llvm_model.compile(cache=compiled_cache, use_fp64=True)
+        else:
+            # lleaves writes the cache as it compiles; build it under a private name and rename it once
+            # complete, so workers compiling at the same time never load a partial kernel
+            staging = f"{compiled_cache}.{os.getpid()}.tmp"
+            llvm_model.compile(cache=staging, use_fp64=True)
+            os.replace(staging, compiled_cache)
+        # Refuse a kernel whose predictions don't match the LightGBM model, and drop its cache file
+        probe = np.zeros((1, len(FEATURE_NAMES)), dtype=np.float32)
+        expected = model.predict_proba(probe, validate_features=False)[0, 1]
+        if not np.isclose(llvm_model.predict(probe, n_jobs=1)[0], expected, atol=1e-5):
+            os.remove(compiled_cache)
+            raise ValueError("compiled predictions do not match the LightGBM model")
+        print("Model compiled with lleaves.")
+    except Exception as e:
+        # The joblib model stays available as the fallback predictor
+        print(f"WARNING: lleaves compilation failed, falling back to predict_proba: {e}")
+        llvm_model = None
+
+# --- LightGBM Fast Single-Row Prediction (C API) ---
+# Used when neither native predictor is available: the prediction config is set up once here instead of on every call.
+# Values from LightGBM's c_api.h
+C_API_PREDICT_NORMAL = 0
+C_API_DTYPE_FLOAT32 = 0
+
+fast_config = None
+if model is not None and native_lib is None and llvm_model is None:
+    try:
+        from lightgbm.basic import _LIB, _safe_call, _c_str
+
+        fast_config = ctypes.c_void_p()
+        _safe_call(_LIB.LGBM_BoosterPredictForMatSingleRowFastInit(
+            model.booster_._handle,
+            ctypes.c_int(C_API_PREDICT_NORMAL),
+            ctypes.c_int(0),  # start_iteration
+            ctypes.c_int(model.booster_.best_iteration or -1),  # same trees as predict_proba
+            ctypes.c_int(C_API_DTYPE_FLOAT32),
+            ctypes.c_int32(len(FEATURE_NAMES)),
+            _c_str("num_threads=1"),
+            ctypes.byref(fast_config)
+        ))
+        print("LightGBM fast single-row predictor initialized.")
+    except Exception as e:
+        print(f"WARNING: Fast single-row init failed, falling back to predict_proba: {e}")
+        fast_config = None
+
+# --- GPU Batch Inference (cuML FIL) ---
+fil_model = None
+_gpu_lock = threading.Lock()
+
+
+def _predict_gpu(batch: np.ndarray) -> np.ndarray:
+    """Scores a float32 batch with FIL on the GPU; returns the positive class probabilities on the host."""
+    # One batch on the device at a time; concurrent batches from the pool queue up here
+    with _gpu_lock:
+        probabilities = fil_model.predict_proba(cupy.asarray(batch))
+    return cupy.asnumpy(probabilities)[:, 1]
+
+
+if model is not None and ForestInference is not None:
+    try:
+        _dump_booster()
+        fil_model = ForestInference.load(BOOSTER_TXT_PATH, output_class=True, model_type="lightgbm")
+        # Refuse a forest whose predictions (e.g. raw margins instead of probabilities) don't match the model
+        probe = np.zeros((1, len(FEATURE_NAMES)), dtype=np.float32)
+        expected = model.predict_proba(probe, validate_features=False)[0, 1]
+        if not np.isclose(_predict_gpu(probe)[0], expected, atol=1e-5):
+            raise ValueError("FIL predictions do not match the LightGBM model")
+        print("Model loaded into cuML FIL for GPU batch scoring.")
+    except Exception as e:
+        print(f"WARNING: cuML FIL unusable, scoring batches on the CPU: {e}")
+        fil_model = None
+
+# --- Inference ---
+def _predict_batch(batch: np.ndarray) -> np.ndarray:
+    """
+    Returns the positive class probability for each row of a (n_rows, n_features) float32 batch,
+    using the GPU (large batches), then the native library, then the compiled lleaves kernel, then the
+    C API fast path (single rows), otherwise predict_proba.
+    """
+    if fil_model is not None and batch.shape[0] >= GPU_MIN_BATCH:
+        return _predict_gpu(batch)
+
+    if native_lib is not None:
+        return _predict_native(batch)
+
+    if llvm_model is not None:
+        # lleaves applies the binary sigmoid itself and returns the positive class probability
+        return llvm_model.predict(batch, n_jobs=1)
+
+    if fast_config is not None and batch.shape[0] == 1:
+        # For the binary objective the single output is the positive class probability
+        out = np.empty(1, dtype=np.float64)
+        out_len = ctypes.c_int64(0)
+        _safe_call(_LIB.LGBM_BoosterPredictForMatSingleRowFast(
+            fast_config,
+            batch.ctypes.data_as(ctypes.c_void_p),
+            ctypes.byref(out_len),
+            out.ctypes.data_as(ctypes.POINTER(ctypes.c_double))
+        ))
+        return out
+
+    # Use .predict_proba() and select the probability of the positive class (index 1)
+    # The rows are already in training column order, so skip LightGBM's feature-name checks
+    probabilities = model.predict_proba(batch, validate_features=False)
+
+    # Check if the output shape is correct (2 columns for binary classification)
+    if probabilities.shape[1] < 2:
+        raise ValueError("Model predict_proba did not return a 2-column array. Check model type.")
+
+    return probabilities[:, 1]
+
+# --- Micro-batching ---
+class _PendingScore(NamedTuple):
+    """A queued feature row and the future its request handler is awaiting."""
+    row: np.ndarray
+    future: asyncio.Future
+
+
+_score_queue: "asyncio.Queue[_PendingScore]" = None
+_batcher_task: asyncio.Task = None
+MODEL_POOL: ThreadPoolExecutor = None
+shm_client: ShmInferenceClient = None
+# Strong references to the batches currently being scored, so their tasks aren't garbage collected
+_batch_tasks: Set[asyncio.Task] = set()
+
+
+async def _drain(queue: asyncio.Queue, max_batch: int, max_wait_ms: float) -> List[_PendingScore]:
+    """Waits for one pending request, then collects more until the batch is full or the window closes."""
+    items = [await queue.get()]
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_wait_ms / 1000
+
+    while len(items) < max_batch:
+        try:
+            items.append(queue.get_nowait())
+            continue
+        except asyncio.QueueEmpty:
+            pass
+        timeout = deadline - loop.time()
+        if timeout <= 0:
+            break
+        try:
+            items.append(await asyncio.wait_for(queue.get(), timeout))
+        except asyncio.TimeoutError:
+            break
+
+    return items
+
+
+async def _score_batch(items: List[_PendingScore], in_flight: asyncio.Semaphore):
+    """Scores one batch on MODEL_POOL (or in the shared-memory worker) and resolves each request's future."""
+    try:
+        rows = [item.row for item in items]
+        if shm_client is not None and shm_client.running:
+            # Rows are stacked straight into the batch's shared-memory slot
+            probabilities = await shm_client.predict(rows)
+        else:
+            probabilities = await asyncio.get_running_loop().run_in_executor(MODEL_POOL, _predict_batch, np.stack(rows))
+    except Exception as e:
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(e)
+        return
+    finally:
+        in_flight.release()
+
+    # A single tolist() converts the whole batch to Python floats instead of one float() per row
+    for item, probability in zip(items, probabilities.tolist()):
+        # The client may have disconnected and cancelled its future
+        if not item.future.done():
+            item.future.set_result(probability)
+
+
+async def _batch_worker():
+    """Background task: drains the queue into batches while a MODEL_POOL thread (or ring slot) is free to score them."""
+    # While every pool thread is busy, new requests keep queueing and form a larger next batch
+    in_flight = asyncio.Semaphore(MODEL_POOL_WORKERS)
+    while True:
+        await in_flight.acquire()
+        items = await _drain(_score_queue, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS)
+        task = asyncio.create_task(_score_batch(items, in_flight))
+        _batch_tasks.add(task)
+        task.add_done_callback(_batch_tasks.discard)
+
 # --- Application Initialization ---
 app = FastAPI(
     title="LightGBM Probability Scoring Microservice",
@@ -34,61 +352,155 @@ app = FastAPI(
     version="1.2.0"
 )
 
+
+@app.on_event("startup")
+async def start_batcher():
+    """Starts the inference backend and the micro-batching task on the server's event loop."""
+    global _score_queue, _batcher_task, MODEL_POOL, shm_client
+    # Also the fallback when the shared-memory worker can't be kept running; its threads start on first use
+    MODEL_POOL = ThreadPoolExecutor(max_workers=MODEL_POOL_WORKERS, thread_name_prefix="model")
+    if SHM_INFERENCE and model is not None:
+        # The worker process imports this module to get _predict_batch; startup hooks don't run there
+        shm_client = ShmInferenceClient(_predict_batch, MODEL_POOL_WORKERS, BATCH_MAX_SIZE, len(FEATURE_NAMES))
+        shm_client.start()
+        print("Shared-memory inference worker started.")
+    _score_queue = asyncio.Queue()
+    _batcher_task = asyncio.create_task(_batch_worker())
+
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    """Stops the micro-batching task and the inference backend."""
+    global shm_client
+    if _batcher_task is not None:
+        _batcher_task.cancel()
+    # Wait for running predictions so native handles aren't freed underneath them
+    if MODEL_POOL is not None:
+        MODEL_POOL.shutdown(wait=True)
+    if shm_client is not None:
+        shm_client.close()
+        shm_client = None
+
+
+@app.on_event("shutdown")
+def release_fast_config():
+    """Frees the native single-row prediction config."""
+    global fast_config
+    if fast_config is not None:
+        _safe_call(_LIB.LGBM_FastConfigFree(fast_config))
+        fast_config = None
+
 # --- Request Data Model (Input) ---
-class FeaturePayload(BaseModel):
+# One required float field per model feature, generated from the Booster; msgspec decodes and validates
+# the JSON body straight into this flat struct, whose fields keep the training column order
+FeatureValues = msgspec.defstruct("FeatureValues", [(name, float) for name in FEATURE_NAMES])
+
+
+class FeaturePayload(msgspec.Struct):
     """Schema for the feature dictionary, including Time, Amount, and V1-V28."""
-    features: Dict[str, float] = Field(
-        ...,
+    features: Annotated[FeatureValues, msgspec.Meta(
         description="A dictionary containing all input features."
-    )
+    )]
+
+
+class FeatureVector(msgspec.Struct):
+    """Compact schema: all feature values as one array, in the model's training column order."""
+    features: Annotated[List[float], msgspec.Meta(
+        min_length=len(FEATURE_NAMES),
+        max_length=len(FEATURE_NAMES),
+        description=f"All {len(FEATURE_NAMES)} input features, ordered as listed in the endpoint's x-feature-order: {FEATURE_NAMES}."
+    )]
     
 # --- Response Data Model (Output) ---
-class AiScoreResponse(BaseModel):
+class AiScoreResponse(msgspec.Struct):
     """Schema for the model scoring response."""
-    score: float = Field(
-        ...,
+    score: Annotated[float, msgspec.Meta(
         description="The probability (0.0 to 1.0) of the positive class."
-    )
-    result: Dict[str, float] = Field(
-        ...,
+    )]
+    result: Annotated[Dict[str, float], msgspec.Meta(
         description=f"The top {TOP_N_FEATURES} features ranked by their absolute magnitude."
-    )
-    
-# --- API Endpoint ---
+    )]
+
+
+# Decoders/encoder are built once; decoding validates the body against the struct in the same pass.
+# strict=False keeps pydantic's lax coercions, e.g. numeric strings for float fields
+_payload_decoder = msgspec.json.Decoder(FeaturePayload, strict=False)
+_vector_decoder = msgspec.json.Decoder(FeatureVector, strict=False)
+_response_encoder = msgspec.json.Encoder()
 
-@app.post("/score", response_model=AiScoreResponse)
-def score_request(payload: FeaturePayload):
+# The endpoints read their bodies themselves, so FastAPI can't infer their schemas; publish the
+# msgspec-generated ones as OpenAPI components instead
+(_PAYLOAD_SCHEMA, _VECTOR_SCHEMA, _RESPONSE_SCHEMA), _SCHEMA_COMPONENTS = msgspec.json.schema_components(
+    (FeaturePayload, FeatureVector, AiScoreResponse),
+    ref_template="#/components/schemas/{name}"
+)
+
+
+def _openapi_body(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """openapi_extra entry documenting a JSON request body."""
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
+
+
+_SCORE_RESPONSES = {200: {"description": "Successful Response", "content": {"application/json": {"schema": _RESPONSE_SCHEMA}}}}
+
+
+def custom_openapi() -> Dict[str, Any]:
+    """FastAPI's generated schema, plus the msgspec struct definitions the endpoints refer to."""
+    if app.openapi_schema is None:
+        schema = FastAPI.openapi(app)
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(_SCHEMA_COMPONENTS)
+        app.openapi_schema = schema
+    return app.openapi_schema
+
+
+app.openapi = custom_openapi
+
+
+# Steps of the JSON path in a msgspec error (`$.features.V3`, `$.features[29]`), and its missing-field message
+_JSON_PATH_STEP = re.compile(r"\.([^.\[]+)|\[(\d+)\]")
+_MISSING_FIELD = re.compile(r"Object missing required field `(.+)`")
+
+
+def _validation_error(e: msgspec.DecodeError) -> RequestValidationError:
     """
-    Scores the provided features and returns the probability score and the top features by magnitude.
+    Reports a msgspec decode failure the way FastAPI reports a pydantic one: a 422 whose detail lists
+    {type, loc, msg} entries, with loc rebuilt from the JSON path msgspec appends to its message.
     """
-    
-    if model is None:
-        raise HTTPException(status_code=503, detail="Model is not loaded or does not support probability prediction. Service unavailable.")
+    message, _, path = str(e).partition(" - at `")
+    loc: List[Any] = ["body"]
+    loc.extend(int(index) if index else key for key, index in _JSON_PATH_STEP.findall(path.rstrip("`")))
+    missing = _MISSING_FIELD.match(message)
+    if missing:
+        loc.append(missing.group(1))
+        kind = "missing"
+    else:
+        kind = "value_error" if isinstance(e, msgspec.ValidationError) else "json_invalid"
+    return RequestValidationError([{"type": kind, "loc": tuple(loc), "msg": message}])
 
-    features_dict = payload.features
-    
-    # 1. Prepare data for the model
+
+def _decode_body(decoder: msgspec.json.Decoder, body: bytes):
+    """Decodes and validates a request body, reporting bad payloads as 422 like FastAPI would."""
     try:
-        data_df = pd.DataFrame([features_dict])
-    except Exception as e:
-        raise HTTPException(
-            status_code=422, 
-            detail=f"Could not convert features to DataFrame. Error: {e}"
-        )
+        return decoder.decode(body)
+    except msgspec.DecodeError as e:
+        raise _validation_error(e)
+
+# --- API Endpoints ---
+
+async def _score_values(feature_values: Sequence[float]) -> AiScoreResponse:
+    """
+    Shared scoring path: takes every feature value in training column order, returns the probability
+    score and the top features by magnitude.
+    """
+    
+    # 1. Prepare data for the model (a single row in training column order)
+    data_row = np.array(feature_values, dtype=np.float32)
 
-    # 2. Make prediction using predict_proba
+    # 2. Make prediction: queue the row for the batcher and wait for its probability
+    future = asyncio.get_running_loop().create_future()
+    await _score_queue.put(_PendingScore(data_row, future))
     try:
-        # Use .predict_proba() and select the probability of the positive class (index 1)
-        # This will return a probability score between 0.0 and 1.0
-        probabilities = model.predict_proba(data_df)
-        # For LightGBM classification, use predict_proba and take the second column (Class 1 probability)
-        
-        # Check if the output shape is correct (2 columns for binary classification)
-        if probabilities.shape[1] < 2:
-            raise ValueError("Model predict_proba did not return a 2-column array. Check model type.")
-            
-        prediction_score = probabilities[0, 1] # Probability of the positive class (index 1)
-        
+        prediction_score = await future
     except Exception as e:
         raise HTTPException(
             status_code=500, 
@@ -96,21 +508,53 @@ def score_request(payload: FeaturePayload):
         )
 
     # 3. Select Top Features by Magnitude
-    feature_list = list(features_dict.items())
-    
-    # Sort the list based on the absolute value (magnitude) of the feature value, descending
-    sorted_features = sorted(feature_list, key=lambda item: abs(item[1]), reverse=True)
-    
-    # Take the top N features
-    top_n_features_list = sorted_features[:TOP_N_FEATURES]
-    
-    # Convert the top N features list back to a dictionary for the response
-    top_n_features_dict = dict(top_n_features_list)
+    # Partial heap selection of the column indices with the N largest absolute values (same order as a
+    # full descending sort); map(abs) and list.__getitem__ keep the key computation out of Python code
+    magnitudes = list(map(abs, feature_values))
+    top_columns = heapq.nlargest(TOP_N_FEATURES, range(len(magnitudes)), key=magnitudes.__getitem__)
+    top_n_features_dict = {FEATURE_NAMES[i]: feature_values[i] for i in top_columns}
 
     # 4. Format the response
     response_data = AiScoreResponse(
-        score=float(prediction_score),
+        score=prediction_score,
         result=top_n_features_dict
     )
 
-    return response_data
\ No newline at end of file
+    return response_data
+
+
+@app.post("/score", openapi_extra=_openapi_body(_PAYLOAD_SCHEMA), responses=_SCORE_RESPONSES)
+@app.post("/score/dict", openapi_extra=_openapi_body(_PAYLOAD_SCHEMA), responses=_SCORE_RESPONSES)
+async def score_request(request: Request):
+    """
+    Scores the provided features and returns the probability score and the top features by magnitude.
+    Kept for existing callers; new callers should use /score/v2.
+    """
+    
+    if model is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded or does not support probability prediction. Service unavailable.")
+
+    # msgspec rejects payloads missing any feature, so every column is present, in training order.
+    payload = _decode_body(_payload_decoder, await request.body())
+    response_data = await _score_values(msgspec.structs.astuple(payload.features))
+    return Response(content=_response_encoder.encode(response_data), media_type="application/json")
+
+
+@app.post(
+    "/score/v2",
+    openapi_extra={**_openapi_body(_VECTOR_SCHEMA), "x-feature-order": FEATURE_NAMES},
+    responses=_SCORE_RESPONSES
+)
+async def score_vector(request: Request):
+    """
+    Scores a feature array laid out in the column order published as x-feature-order,
+    and returns the probability score and the top features by magnitude.
+    """
+    
+    if model is None:
+        raise HTTPException(status_code=503, detail="Model is not loaded or does not support probability prediction. Service unavailable.")
+
+    # msgspec has already checked that the array holds exactly one value per feature.
+    payload = _decode_body(_vector_decoder, await request.body())
+    response_data = await _score_values(payload.features)
+    return Response(content=_response_encoder.encode(response_data), media_type="application/json")
@@ -0,0 +1,205 @@
+"""
+Shared-memory inference worker for the scoring service.
+
+The serving process writes float32 feature batches into a SharedMemory ring of slots and only posts
+the slot index on a queue; a dedicated worker process scores the slot in place and writes the
+probabilities into a second SharedMemory region. No feature data is pickled between the processes,
+and model inference never holds the serving process's GIL.
+"""
+import asyncio
+import multiprocessing as mp
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def _worker_main(
+    predict: Callable[[np.ndarray], np.ndarray],
+    in_name: str,
+    out_name: str,
+    n_slots: int,
+    max_batch: int,
+    n_features: int,
+    requests: mp.Queue,
+    results: Connection
+):
+    """
+    Worker process loop: scores (slot, n_rows) requests in place until it receives None.
+    Slots are scored concurrently, one thread per slot; the predictors are single-threaded and release
+    the GIL, so in-flight batches spread over the cores as they do on the serving process's thread pool.
+    """
+    # The worker is started by multiprocessing and shares the serving process's resource tracker,
+    # so attaching here doesn't hand the regions' cleanup over to this process
+    in_shm = shared_memory.SharedMemory(name=in_name)
+    out_shm = shared_memory.SharedMemory(name=out_name)
+    inputs = np.ndarray((n_slots, max_batch, n_features), dtype=np.float32, buffer=in_shm.buf)
+    outputs = np.ndarray((n_slots, max_batch), dtype=np.float64, buffer=out_shm.buf)
+
+    send_lock = threading.Lock()
+
+    def score(slot: int, n_rows: int):
+        try:
+            outputs[slot, :n_rows] = predict(inputs[slot, :n_rows])
+            answer = (slot, None)
+        except Exception as e:
+            answer = (slot, f"{type(e).__name__}: {e}")
+        # One writer at a time on the pipe
+        with send_lock:
+            results.send(answer)
+
+    pool = ThreadPoolExecutor(max_workers=n_slots, thread_name_prefix="shm-model")
+    try:
+        while True:
+            message = requests.get()
+            if message is None:
+                break
+            pool.submit(score, *message)
+    finally:
+        # Finish the slots already taken before the regions are released
+        pool.shutdown(wait=True)
+        del inputs, outputs
+        in_shm.close()
+        out_shm.close()
+        results.close()
+
+
+class ShmInferenceClient:
+    """
+    Serving-side handle of the worker process. `predict` is awaited from the event loop; each in-flight
+    batch owns one slot of the ring until the worker has answered for it.
+    If the worker dies, the batches it held fail and a new worker is started; one that dies before ever
+    answering is not restarted, and `running` turns False so the caller can score elsewhere.
+    """
+
+    def __init__(self, predict: Callable[[np.ndarray], np.ndarray], n_slots: int, max_batch: int, n_features: int):
+        self._predict = predict
+        self._n_slots = n_slots
+        self._max_batch = max_batch
+        self._n_features = n_features
+
+        self._in_shm = shared_memory.SharedMemory(create=True, size=n_slots * max_batch * max(n_features, 1) * 4)
+        self._out_shm = shared_memory.SharedMemory(create=True, size=n_slots * max_batch * 8)
+        self._inputs = np.ndarray((n_slots, max_batch, n_features), dtype=np.float32, buffer=self._in_shm.buf)
+        self._outputs = np.ndarray((n_slots, max_batch), dtype=np.float64, buffer=self._out_shm.buf)
+
+        # Spawn so the worker starts from a clean interpreter rather than a fork of the event loop
+        self._ctx = mp.get_context("spawn")
+        self._process: Optional[mp.Process] = None
+        self._requests: Optional[mp.Queue] = None
+        self._reader: Optional[threading.Thread] = None
+        self._answered = False
+        self._closing = False
+        self.running = False
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._free_slots: Optional[asyncio.Queue] = None
+        self._pending: Dict[int, Tuple[asyncio.Future, int]] = {}
+
+    def start(self):
+        """Starts the worker process and the thread relaying its answers; call from the event loop."""
+        self._loop = asyncio.get_running_loop()
+        self._free_slots = asyncio.Queue()
+        for slot in range(self._n_slots):
+            self._free_slots.put_nowait(slot)
+        self._spawn()
+
+    def _spawn(self):
+        """Starts a worker process with its own request queue and result pipe, and a reader thread for it."""
+        self._requests = self._ctx.Queue()
+        results, worker_results = self._ctx.Pipe(duplex=False)
+        self._process = self._ctx.Process(
+            target=_worker_main,
+            args=(self._predict, self._in_shm.name, self._out_shm.name, self._n_slots, self._max_batch,
+                  self._n_features, self._requests, worker_results),
+            daemon=True
+        )
+        self._process.start()
+        worker_results.close()
+        self._answered = False
+        self.running = True
+        self._reader = threading.Thread(
+            target=self._relay_results, args=(self._process, results), name="shm-results", daemon=True
+        )
+        self._reader.start()
+
+    async def predict(self, rows: List[np.ndarray]) -> np.ndarray:
+        """Scores up to max_batch float32 rows in the worker process; returns their probabilities."""
+        slot = await self._free_slots.get()
+        if not self.running:
+            self._free_slots.put_nowait(slot)
+            raise RuntimeError("Shared-memory inference worker is not running")
+        n_rows = len(rows)
+        np.stack(rows, out=self._inputs[slot, :n_rows])
+        future = self._loop.create_future()
+        self._pending[slot] = (future, n_rows)
+        self._requests.put((slot, n_rows))
+        return await future
+
+    def _relay_results(self, process: mp.Process, results: Connection):
+        """Reader thread: hands each of the worker's answers back to the event loop, then reports its exit."""
+        try:
+            while True:
+                # Answers already in the pipe are relayed before the worker's exit is acted on
+                ready = wait([results, process.sentinel])
+                if results not in ready:
+                    break
+                try:
+                    message = results.recv()
+                except EOFError:
+                    break
+                self._loop.call_soon_threadsafe(self._complete, *message)
+        finally:
+            results.close()
+        if not self._closing:
+            self._loop.call_soon_threadsafe(self._worker_exited, process)
+
+    def _complete(self, slot: int, error: Optional[str]):
+        self._answered = True
+        future, n_rows = self._pending.pop(slot)
+        if not future.done():
+            if error is None:
+                future.set_result(self._outputs[slot, :n_rows].copy())
+            else:
+                future.set_exception(RuntimeError(error))
+        # The slot is only reused once the worker is done with it, even if the caller went away
+        self._free_slots.put_nowait(slot)
+
+    def _worker_exited(self, process: mp.Process):
+        """Fails the batches a dead worker was holding, frees their slots, and replaces the worker."""
+        if self._closing or process is not self._process:
+            return
+        process.join()
+        error = RuntimeError(f"Shared-memory inference worker exited unexpectedly (exit code {process.exitcode})")
+        for slot, (future, _) in self._pending.items():
+            if not future.done():
+                future.set_exception(error)
+            self._free_slots.put_nowait(slot)
+        self._pending.clear()
+
+        if self._answered:
+            print(f"WARNING: {error}; restarting it.")
+            self._spawn()
+        else:
+            # It never got as far as scoring (e.g. the model failed to load); a restart would fail the same way
+            print(f"WARNING: {error} before scoring any batch; not restarting it.")
+            self.running = False
+
+    def close(self):
+        """Stops the worker process and the reader thread, then releases the shared memory."""
+        self._closing = True
+        self.running = False
+        if self._process is not None and self._process.is_alive():
+            self._requests.put(None)
+            self._process.join(timeout=5)
+            if self._process.is_alive():
+                self._process.terminate()
+        if self._reader is not None:
+            self._reader.join(timeout=5)
+        del self._inputs, self._outputs
+        for shm in (self._in_shm, self._out_shm):
+            shm.close()
+            shm.unlink()
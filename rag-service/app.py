@@ -1,7 +1,12 @@
 import json
-from typing import Dict, List, Any
-from fastapi import FastAPI, Body, status, Response
-from pydantic import BaseModel, Field
+import re
+import sys
+from functools import lru_cache
+from typing import Annotated, Dict, List, Any, Tuple
+import ahocorasick
+import msgspec
+from fastapi import FastAPI, Request, Response, status
+from fastapi.exceptions import RequestValidationError
 
 # --- 1. CONFIGURATION: Static Knowledge Base (Policy Context) ---
 
@@ -14,6 +19,11 @@ KNOWLEDGE_DB: Dict[str, str] = {
     "NEW_DEVICE_LOGIN": "A new device being used to log in or transact increases the probability of fraud, especially if geolocation changes.",
     "AI_ANOMALY": "The AI Anomaly Detection Model has flagged a significant risk driver that is too subtle for manual rules."
 }
+# Intern the snippets so every response reuses the same string objects
+KNOWLEDGE_DB = {key: sys.intern(text) for key, text in KNOWLEDGE_DB.items()}
+
+# Leading sentence of each snippet, used as the summary when it comes first in the retrieved context
+KNOWLEDGE_FIRST_SENTENCE: Dict[str, str] = {key: sys.intern(text.split('.', 1)[0]) for key, text in KNOWLEDGE_DB.items()}
 
 # Mapping common rule flags (or parts of them) to the official KNOWLEDGE_DB keys.
 FLAG_KEYWORD_MAP: Dict[str, str] = {
@@ -27,61 +37,92 @@ FLAG_KEYWORD_MAP: Dict[str, str] = {
     "device": "NEW_DEVICE_LOGIN",
 }
 
+# Aho-Corasick automaton over the keywords, so each flag is scanned once instead of once per keyword.
+# Values carry the keyword's position in FLAG_KEYWORD_MAP: the earliest listed keyword still wins.
+KEYWORD_AUTOMATON = ahocorasick.Automaton()
+for priority, (keyword, db_key) in enumerate(FLAG_KEYWORD_MAP.items()):
+    KEYWORD_AUTOMATON.add_word(keyword, (priority, db_key))
+KEYWORD_AUTOMATON.make_automaton()
+
 
-# --- 2. PYDANTIC MODELS (Input/Output) ---
+# --- 2. MSGSPEC MODELS (Input/Output) ---
 
-class RagRequest(BaseModel):
+class RagRequest(msgspec.Struct, kw_only=True):
     """Input payload containing all hybrid detection results."""
-    applicantId: str = Field(..., description="Unique ID for the applicant.")
-    attributes: Dict[str, Any] = Field({}, description="Additional application attributes (optional).")
-    ruleFlags: List[str] = Field(..., description="Flags triggered by the Traditional Rules-Based Engine.")
-    aiScore: float = Field(..., description="The overall anomaly score from the AI-Based Engine (0.0 to 1.0).", ge=0.0, le=1.0)
+    applicantId: Annotated[str, msgspec.Meta(description="Unique ID for the applicant.")]
+    attributes: Annotated[Dict[str, Any], msgspec.Meta(description="Additional application attributes (optional).")] = {}
+    ruleFlags: Annotated[List[str], msgspec.Meta(description="Flags triggered by the Traditional Rules-Based Engine.")]
+    aiScore: Annotated[float, msgspec.Meta(description="The overall anomaly score from the AI-Based Engine (0.0 to 1.0).", ge=0.0, le=1.0)]
     
     # Optional field to pass the top features from the previous step's 'result' map
-    topFeatures: Dict[str, float] = Field({}, description="The top N features impacting the AI score.")
+    topFeatures: Annotated[Dict[str, float], msgspec.Meta(description="The top N features impacting the AI score.")] = {}
 
 
-class RagResponse(BaseModel):
+class RagResponse(msgspec.Struct):
     """The synthesized reasoning output."""
-    reasoning: str = Field(..., description="The final, synthesized explanation for the risk decision.")
-    riskCategory: str = Field(..., description="The categorized risk level: LOW, MEDIUM, or HIGH.")
-    confidence: float = Field(..., description="The AI anomaly score, rounded for presentation.")
+    reasoning: Annotated[str, msgspec.Meta(description="The final, synthesized explanation for the risk decision.")]
+    riskCategory: Annotated[str, msgspec.Meta(description="The categorized risk level: LOW, MEDIUM, or HIGH.")]
+    confidence: Annotated[float, msgspec.Meta(description="The AI anomaly score, rounded for presentation.")]
+
+
+# Built once; decoding validates the body against RagRequest in the same pass.
+# strict=False keeps pydantic's lax coercions, e.g. a numeric string for aiScore
+_request_decoder = msgspec.json.Decoder(RagRequest, strict=False)
+_response_encoder = msgspec.json.Encoder()
+
+# /explain reads its body itself, so FastAPI can't infer the schemas; publish msgspec's as OpenAPI components
+(_REQUEST_SCHEMA, _RESPONSE_SCHEMA), _SCHEMA_COMPONENTS = msgspec.json.schema_components(
+    (RagRequest, RagResponse),
+    ref_template="#/components/schemas/{name}"
+)
 
 
 # --- 3. CORE LOGIC FUNCTIONS ---
 
-def retrieve_knowledge(rule_flags: List[str], ai_score: float) -> str:
+@lru_cache(maxsize=4096)
+def _retrieve_cached(flags_key: Tuple[str, ...], ai_anomaly: bool) -> Tuple[str, str]:
     """
-    (R)etrieval: Selects relevant policy context based on triggered rules and AI score threshold.
+    Memoized retrieval over lowercased, sorted rule flags and whether the AI score crossed the anomaly threshold.
+    Returns the joined context and the first sentence of its leading snippet.
     """
     
     retrieved_keys = set()
     
     # 1. Match Rule Flags to Policy Context
-    for flag in rule_flags:
-        # Normalize the flag for comparison
-        flag_lower = flag.lower()
-        
-        for keyword, db_key in FLAG_KEYWORD_MAP.items():
-            if keyword in flag_lower:
-                retrieved_keys.add(db_key)
-                # Found a match, move to the next flag
-                break
+    for flag_lower in flags_key:
+        # Keep only the first matching keyword (in FLAG_KEYWORD_MAP order) for this flag
+        first_match = min((match for _, match in KEYWORD_AUTOMATON.iter(flag_lower)), default=None)
+        if first_match is not None:
+            retrieved_keys.add(first_match[1])
             
     # 2. Match AI Score to Generic Context
-    # Use a clear threshold for an AI-only decision flag
-    if ai_score >= 0.6:
+    if ai_anomaly:
         retrieved_keys.add("AI_ANOMALY")
 
     # Retrieve the actual knowledge snippets
-    context = [KNOWLEDGE_DB[key] for key in retrieved_keys]
+    ordered_keys = list(retrieved_keys)
+    context = [KNOWLEDGE_DB[key] for key in ordered_keys]
+    summary = KNOWLEDGE_FIRST_SENTENCE[ordered_keys[0]] if ordered_keys else ""
     
     # Format the context into a single string
-    return "\n".join(context)
+    return "\n".join(context), summary
+
+
+def retrieve_knowledge(rule_flags: List[str], ai_score: float) -> Tuple[str, str]:
+    """
+    (R)etrieval: Selects relevant policy context based on triggered rules and AI score threshold.
+    Returns the context string and its precomputed one-sentence summary.
+    """
+    # Normalize each flag once for comparison. The lowercased tuple is both what the automaton scans and
+    # the cache key: sorted and de-duplicated, since neither order nor repeats change the retrieved keys.
+    flags_lower = tuple(sorted({flag.lower() for flag in rule_flags}))
+    
+    # Use a clear threshold for an AI-only decision flag
+    return _retrieve_cached(flags_lower, ai_score >= 0.6)
 
 # --- 3. CORE LOGIC FUNCTIONS (Modified) ---
 
-def generate_reasoning_and_risk(context: str, request: RagRequest) -> RagResponse:
+def generate_reasoning_and_risk(context: str, summary: str, request: RagRequest) -> RagResponse:
     """
     (G)eneration: Synthesizes the retrieved context and hybrid scores into a final decision,
     falling back to listing raw rule flags when RAG context is unavailable.
@@ -95,7 +136,7 @@ def generate_reasoning_and_risk(context: str, request: RagRequest) -> RagRespons
     # Determine the primary explanation source: RAG context or raw flags.
     if context:
         # Use the first sentence of the RAG context for a summary
-        summary_context = context.split('.')[0]
+        summary_context = summary
         context_source = "RAG policy context"
     elif num_rules_triggered > 0:
         # Fallback: Use the triggered rule flags as the explanation
@@ -110,33 +151,30 @@ def generate_reasoning_and_risk(context: str, request: RagRequest) -> RagRespons
 
 
     # --- Hybrid Decision Logic ---
+    # Fragments shared by the branches, formatted once
+    score_pct = f"{confidence*100:.2f}%"
+    ai_str = f"{ai_score:.4f}"
     
     # High Risk: Strong signal from either engine
     if ai_score >= 0.7 or num_rules_triggered >= 2:
         risk_category = "HIGH"
+        # The top feature names are only listed by the HIGH and MEDIUM messages; iterating a dict yields its keys
+        top_keys = list(request.topFeatures)
         
-        reasoning = (
-            f"**HIGH RISK ({confidence*100:.2f}%)**: Immediate manual review/block required. "
-            f"Risk is severe due to multiple Rule Flags ({num_rules_triggered}) and/or a high AI Anomaly Score ({ai_score:.4f}). "
-            f"Key risk drivers (Source: {context_source}): {summary_context}. The top features impacting the AI score were: {list(request.topFeatures.keys())}."
-        )
+        reasoning = f"**HIGH RISK ({score_pct})**: Immediate manual review/block required. Risk is severe due to multiple Rule Flags ({num_rules_triggered}) and/or a high AI Anomaly Score ({ai_str}). Key risk drivers (Source: {context_source}): {summary_context}. The top features impacting the AI score were: {top_keys}."
         
     # Medium Risk: Moderate signal, requires analyst intervention
     elif ai_score >= 0.4 or num_rules_triggered >= 1:
         risk_category = "MEDIUM"
+        trigger = 'Rule Flags' if num_rules_triggered > 0 else 'a moderate AI anomaly'
+        top_keys = list(request.topFeatures)
         
-        reasoning = (
-            f"**MEDIUM RISK ({confidence*100:.2f}%)**: Requires manual review by an analyst. "
-            f"The risk is moderate, triggered by {'Rule Flags' if num_rules_triggered > 0 else 'a moderate AI anomaly'}. "
-            f"Context (Source: {context_source}): {summary_context}. Review top features: {list(request.topFeatures.keys())}."
-        )
+        reasoning = f"**MEDIUM RISK ({score_pct})**: Requires manual review by an analyst. The risk is moderate, triggered by {trigger}. Context (Source: {context_source}): {summary_context}. Review top features: {top_keys}."
         
     # Low Risk: Safe to approve
     else:
         risk_category = "LOW"
-        reasoning = (
-            f"**LOW RISK ({confidence*100:.2f}%)**: No significant fraud indicators detected by the hybrid system. Transaction approved."
-        )
+        reasoning = f"**LOW RISK ({score_pct})**: No significant fraud indicators detected by the hybrid system. Transaction approved."
         
     # Return the full RagResponse object
     return RagResponse(
@@ -154,26 +192,76 @@ app = FastAPI(
     version="1.2"
 )
 
-@app.post("/explain", response_model=RagResponse, status_code=status.HTTP_200_OK)
-async def reason_orchestrator(request: RagRequest = Body(
-    ..., 
-    example={
-        "applicantId": "A123456",
-        "attributes": {"loan_type": "Personal", "ip_country": "US"},
-        "ruleFlags": ["REAPPLY_VELOCITY_24_HOURS", "AMOUNT_OVER_10K"],
-        "aiScore": 0.825,
-        "topFeatures": {"V14": 0.4550, "V4": 0.4263, "Amount": 7.8244}
-    }
-)):
+def custom_openapi() -> Dict[str, Any]:
+    """FastAPI's generated schema, plus the msgspec struct definitions /explain refers to."""
+    if app.openapi_schema is None:
+        schema = FastAPI.openapi(app)
+        schema.setdefault("components", {}).setdefault("schemas", {}).update(_SCHEMA_COMPONENTS)
+        app.openapi_schema = schema
+    return app.openapi_schema
+
+
+app.openapi = custom_openapi
+
+
+# Steps of the JSON path in a msgspec error (`$.aiScore`, `$.ruleFlags[0]`), and its missing-field message
+_JSON_PATH_STEP = re.compile(r"\.([^.\[]+)|\[(\d+)\]")
+_MISSING_FIELD = re.compile(r"Object missing required field `(.+)`")
+
+
+def _validation_error(e: msgspec.DecodeError) -> RequestValidationError:
+    """
+    Reports a msgspec decode failure the way FastAPI reports a pydantic one: a 422 whose detail lists
+    {type, loc, msg} entries, with loc rebuilt from the JSON path msgspec appends to its message.
+    """
+    message, _, path = str(e).partition(" - at `")
+    loc: List[Any] = ["body"]
+    loc.extend(int(index) if index else key for key, index in _JSON_PATH_STEP.findall(path.rstrip("`")))
+    missing = _MISSING_FIELD.match(message)
+    if missing:
+        loc.append(missing.group(1))
+        kind = "missing"
+    else:
+        kind = "value_error" if isinstance(e, msgspec.ValidationError) else "json_invalid"
+    return RequestValidationError([{"type": kind, "loc": tuple(loc), "msg": message}])
+
+
+def _decode_body(decoder: msgspec.json.Decoder, body: bytes):
+    """Decodes and validates a request body, reporting bad payloads as 422 like FastAPI would."""
+    try:
+        return decoder.decode(body)
+    except msgspec.DecodeError as e:
+        raise _validation_error(e)
+
+
+@app.post(
+    "/explain",
+    status_code=status.HTTP_200_OK,
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {
+        "schema": _REQUEST_SCHEMA,
+        "example": {
+            "applicantId": "A123456",
+            "attributes": {"loan_type": "Personal", "ip_country": "US"},
+            "ruleFlags": ["REAPPLY_VELOCITY_24_HOURS", "AMOUNT_OVER_10K"],
+            "aiScore": 0.825,
+            "topFeatures": {"V14": 0.4550, "V4": 0.4263, "Amount": 7.8244}
+        }
+    }}}},
+    responses={200: {"description": "Successful Response", "content": {"application/json": {"schema": _RESPONSE_SCHEMA}}}}
+)
+async def reason_orchestrator(http_request: Request):
     """
     The main orchestrator that synthesizes Rule Flags and AI Scores into a final reasoning.
     """
     
+    # msgspec validates the body against RagRequest while decoding it
+    request = _decode_body(_request_decoder, await http_request.body())
+    
     # 1. RETRIEVAL (RAG Concept): Look up relevant business context
     # Note: We pass aiScore directly as we don't use 'attributes' for the AI score check.
-    context = retrieve_knowledge(request.ruleFlags, request.aiScore)
+    context, summary = retrieve_knowledge(request.ruleFlags, request.aiScore)
     
     # 2. GENERATION: Synthesize the final decision and reasoning
-    response_obj = generate_reasoning_and_risk(context, request)
+    response_obj = generate_reasoning_and_risk(context, summary, request)
     
-    return response_obj
\ No newline at end of file
+    return Response(content=_response_encoder.encode(response_obj), media_type="application/json")